@@ -2,8 +2,10 @@ import os
 import time
 import html
 import logging
-from threading import Thread
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Thread, Lock, local
+from dataclasses import dataclass, field
 
 import telebot
 from telebot import types
@@ -24,16 +26,42 @@ r = redis.from_url(REDIS_URL, decode_responses=True)
 class BotConfig:
     TOKEN: str = os.environ.get('BOT_TOKEN', '')
     ADMIN_ID: int = int(os.environ.get('ADMIN_ID', '0'))
+    # Comma-separated list of extra admins; ADMIN_ID is always included.
+    ADMIN_IDS: frozenset = field(default_factory=lambda: frozenset(
+        int(x) for x in os.environ.get('ADMIN_IDS', '').split(',') if x.strip()
+    ))
+    ADMIN_ROUTING: str = os.environ.get('ADMIN_ROUTING', 'least_backlog')  # or 'round_robin'
+    DIALOG_TTL: int = int(os.environ.get('DIALOG_TTL', 86400))
     CHANNEL_URL: str = 'https://t.me/kuznya_music'
     EXAMPLES_URL: str = 'https://t.me/kuznya_music/41'
     WEBHOOK_PORT: int = int(os.environ.get('PORT', 8080))
     MAX_MESSAGE_LENGTH: int = 4000
     RATE_LIMIT_MESSAGES: int = 5
     WEBHOOK_URL: str = os.environ.get('WEBHOOK_URL', '')
+    UPDATE_DEDUP_TTL: int = int(os.environ.get('UPDATE_DEDUP_TTL', 86400))
+    UPDATE_DEDUP_CACHE_SIZE: int = 2048
+    RUN_MODE: str = os.environ.get('RUN_MODE', 'webhook')  # 'webhook' or 'polling'
+    POLLING_BATCH_SIZE: int = 100
+    POLLING_WORKERS: int = int(os.environ.get('POLLING_WORKERS', 8))
+    POLLING_TIMEOUT: int = int(os.environ.get('POLLING_TIMEOUT', 50))
+
+    def __post_init__(self):
+        if not self.ADMIN_ID and self.ADMIN_IDS:
+            self.ADMIN_ID = min(self.ADMIN_IDS)
+        if self.ADMIN_ID:
+            self.ADMIN_IDS = self.ADMIN_IDS | {self.ADMIN_ID}
+        # Stable order for round-robin routing.
+        self.ADMIN_ORDER = tuple(sorted(self.ADMIN_IDS))
 
 config = BotConfig()
-if not config.TOKEN or not config.ADMIN_ID or not config.WEBHOOK_URL:
-    raise ValueError("BOT_TOKEN, ADMIN_ID, or WEBHOOK_URL missing in environment variables!")
+if not config.TOKEN or not config.ADMIN_ID:
+    raise ValueError("BOT_TOKEN or ADMIN_ID/ADMIN_IDS missing in environment variables!")
+if config.ADMIN_ROUTING not in ("least_backlog", "round_robin"):
+    raise ValueError(f"ADMIN_ROUTING must be 'least_backlog' or 'round_robin'! Got: {config.ADMIN_ROUTING}")
+if config.RUN_MODE not in ("webhook", "polling"):
+    raise ValueError(f"RUN_MODE must be 'webhook' or 'polling'! Got: {config.RUN_MODE}")
+if config.RUN_MODE == "webhook" and not config.WEBHOOK_URL:
+    raise ValueError("WEBHOOK_URL missing in environment variables (required for webhook mode)!")
 
 # -------- TEXTS --------
 class Messages:
@@ -83,6 +111,7 @@ class Messages:
     ERROR_MESSAGE_TOO_LONG = f"❌ Повідомлення занадто довге. Максимум {config.MAX_MESSAGE_LENGTH} символів."
     ERROR_RATE_LIMITED = "❌ Забагато повідомлень. Зачекайте хвилинку."
     ERROR_INVALID_INPUT = "❌ Некоректне повідомлення. Спробуйте ще раз."
+    ERROR_DIALOG_CLOSED = "⌛ Цей діалог вже завершено. Напишіть нове повідомлення через '🎤 Записати трек'."
     ADMIN_PANEL_WELCOME = "👑 Вітаємо в адмін-панелі Kuznya Music!\nОберіть дію з меню:"
     ADMIN_MENU_NAV = "👑 Ви в адмін-панелі. Скористайтеся кнопками меню:"
 
@@ -113,7 +142,9 @@ def safe_handler(func):
         except Exception as e:
             logger.error(f"Handler error in {func.__name__}: {e}", exc_info=True)
             try:
-                bot.send_message(message.chat.id, "❌ Виникла технічна помилка, спробуйте ще раз або пізніше.", parse_mode="HTML")
+                chat = getattr(message, "chat", None)
+                chat_id = chat.id if chat else message.from_user.id
+                bot.send_message(chat_id, "❌ Виникла технічна помилка, спробуйте ще раз або пізніше.", parse_mode="HTML")
             except Exception:
                 pass
     return wrapper
@@ -124,7 +155,9 @@ def safe_send(chat_id, text, **kwargs):
     except Exception as e:
         logger.error(f"Telegram send_message error: {e}", exc_info=True)
 
-bot = telebot.TeleBot(config.TOKEN)
+# In polling mode handlers run inline on the polling worker pool, so a batch is
+# finished before its offset is saved.
+bot = telebot.TeleBot(config.TOKEN, threaded=config.RUN_MODE != "polling")
 try:
     bot_info = bot.get_me()
     logger.info(f"Bot token is valid! Bot name: {bot_info.first_name} (@{bot_info.username})")
@@ -134,7 +167,7 @@ except Exception as token_error:
 logger.info("Bot started (main entrypoint).")
 
 def is_admin(user_id: int) -> bool:
-    return int(user_id) == int(config.ADMIN_ID)
+    return int(user_id) in config.ADMIN_IDS
 
 def get_main_keyboard():
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
@@ -170,6 +203,11 @@ def get_admin_keyboard():
     )
     return markup
 
+def get_reply_markup(action: str, target_id: int, label: str = "↩️ Відповісти"):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(label, callback_data=encode_callback(action, target_id)))
+    return markup
+
 def validate_message(message):
     if not message or not message.text:
         return False, Messages.ERROR_INVALID_INPUT
@@ -181,12 +219,18 @@ def check_rate_limit(user_id: int) -> bool:
     return True
 
 def set_user_state(user_id: int, state: str):
+    prefetched = getattr(_state_prefetch, "states", None)
+    if prefetched is not None:
+        prefetched[user_id] = state
     try:
         r.set(f"user:{user_id}:state", state)
     except Exception as e:
         logger.error(f"Redis error in set_user_state: {e}", exc_info=True)
 
 def get_user_state(user_id: int) -> str:
+    prefetched = getattr(_state_prefetch, "states", None)
+    if prefetched is not None and user_id in prefetched:
+        return prefetched[user_id] or UserStates.IDLE
     try:
         return r.get(f"user:{user_id}:state") or UserStates.IDLE
     except Exception as e:
@@ -246,6 +290,98 @@ def get_stat(key):
         logger.error(f"Redis error in get_stat: {e}", exc_info=True)
         return 0
 
+# -------- UPDATE DE-DUPLICATION --------
+# Telegram redelivers an update when the webhook answers 500 or too slowly.
+# Each update_id is claimed in Redis (SET NX EX) before dispatch; a small
+# in-process ring buffer catches fast retries without a round-trip.
+class RecentUpdateIds:
+    def __init__(self, maxlen: int):
+        self._order = deque(maxlen=maxlen)
+        self._ids = set()
+        self._lock = Lock()
+
+    def add(self, update_id: int) -> bool:
+        """Remember update_id; returns False if it was already seen."""
+        with self._lock:
+            if update_id in self._ids:
+                return False
+            if len(self._order) == self._order.maxlen:
+                self._ids.discard(self._order[0])
+            self._order.append(update_id)
+            self._ids.add(update_id)
+            return True
+
+    def discard(self, update_id: int):
+        with self._lock:
+            if update_id in self._ids:
+                self._ids.discard(update_id)
+                self._order.remove(update_id)
+
+    def __contains__(self, update_id: int) -> bool:
+        with self._lock:
+            return update_id in self._ids
+
+recent_update_ids = RecentUpdateIds(config.UPDATE_DEDUP_CACHE_SIZE)
+
+# Per-thread user states read together with the update claim; used by handler
+# filters while the update is being dispatched.
+_state_prefetch = local()
+
+def get_update_user_id(update):
+    for event in (update.message, update.edited_message, update.callback_query):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+    return None
+
+def claim_update(update, user_id=None):
+    """Return (is_new, state, prefetched) for an incoming update.
+
+    prefetched is True when the sender's state was read from Redis; state may
+    then be None for a user with no stored state.
+    """
+    if not recent_update_ids.add(update.update_id):
+        return False, None, False
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.set(f"update:{update.update_id}", 1, nx=True, ex=config.UPDATE_DEDUP_TTL)
+        if user_id is not None:
+            pipe.get(f"user:{user_id}:state")
+        results = pipe.execute()
+        state = results[1] if user_id is not None else None
+        return bool(results[0]), state, user_id is not None
+    except Exception as e:
+        logger.error(f"Redis error in claim_update: {e}", exc_info=True)
+        return True, None, False
+
+def release_update(update):
+    """Forget a claimed update so Telegram's redelivery is processed again."""
+    recent_update_ids.discard(update.update_id)
+    try:
+        r.delete(f"update:{update.update_id}")
+    except Exception as e:
+        logger.error(f"Redis error in release_update: {e}", exc_info=True)
+
+def process_update(update):
+    # Acknowledge button taps before any Redis round-trip so the spinner stops at once.
+    # A redelivery already seen locally was answered the first time.
+    if update.callback_query is not None and update.update_id not in recent_update_ids:
+        answer_callback(update.callback_query)
+    user_id = get_update_user_id(update)
+    is_new, state, prefetched = claim_update(update, user_id)
+    if not is_new:
+        incr_stat("duplicate_updates")
+        logger.info(f"Duplicate update {update.update_id} dropped")
+        return False
+    _state_prefetch.states = {user_id: state} if prefetched else {}
+    try:
+        bot.process_new_updates([update])
+    except Exception:
+        release_update(update)
+        raise
+    finally:
+        _state_prefetch.states = None
+    return True
+
 def set_admin_state(user_id, state):
     try:
         r.set(f"admin:{user_id}:state", state)
@@ -265,6 +401,101 @@ def clear_admin_state(user_id):
     except Exception as e:
         logger.error(f"Redis error in clear_admin_state: {e}", exc_info=True)
 
+# -------- ADMIN ROUTING --------
+# Each dialog is pinned to one admin (dialog:<user_id>:admin) so follow-ups
+# reach the same person. An admin's open dialogs are a sorted set of user ids
+# scored by last activity; pins and set members both expire after DIALOG_TTL
+# of silence, so abandoned dialogs drop out of the backlog on their own.
+ADMIN_ROUND_ROBIN_KEY = "admins:rr"
+
+def admin_dialogs_key(admin_id: int) -> str:
+    return f"admin:{admin_id}:dialogs"
+
+def get_admin_backlog() -> dict:
+    cutoff = time.time() - config.DIALOG_TTL
+    try:
+        pipe = r.pipeline(transaction=False)
+        for admin_id in config.ADMIN_ORDER:
+            pipe.zremrangebyscore(admin_dialogs_key(admin_id), "-inf", cutoff)
+            pipe.zcard(admin_dialogs_key(admin_id))
+        counts = pipe.execute()[1::2]
+    except Exception as e:
+        logger.error(f"Redis error in get_admin_backlog: {e}", exc_info=True)
+        counts = [0] * len(config.ADMIN_ORDER)
+    return dict(zip(config.ADMIN_ORDER, counts))
+
+def pick_admin() -> int:
+    if len(config.ADMIN_ORDER) == 1:
+        return config.ADMIN_ORDER[0]
+    if config.ADMIN_ROUTING == "round_robin":
+        try:
+            turn = r.incr(ADMIN_ROUND_ROBIN_KEY)
+        except Exception as e:
+            logger.error(f"Redis error in pick_admin: {e}", exc_info=True)
+            return config.ADMIN_ID
+        return config.ADMIN_ORDER[turn % len(config.ADMIN_ORDER)]
+    backlog = get_admin_backlog()
+    return min(config.ADMIN_ORDER, key=lambda admin_id: backlog[admin_id])
+
+def get_dialog_admin(user_id: int):
+    try:
+        admin_id = r.get(f"dialog:{user_id}:admin")
+    except Exception as e:
+        logger.error(f"Redis error in get_dialog_admin: {e}", exc_info=True)
+        return None
+    if admin_id and is_admin(admin_id):
+        return int(admin_id)
+    return None
+
+def touch_dialog(user_id: int, admin_id: int):
+    pipe = r.pipeline(transaction=False)
+    pipe.expire(f"dialog:{user_id}:admin", config.DIALOG_TTL)
+    pipe.zadd(admin_dialogs_key(admin_id), {user_id: time.time()})
+    pipe.execute()
+
+def assign_admin(user_id: int) -> int:
+    """Return the admin owning user_id's dialog, assigning one if needed."""
+    admin_id = get_dialog_admin(user_id)
+    try:
+        if admin_id:
+            touch_dialog(user_id, admin_id)
+            return admin_id
+        admin_id = pick_admin()
+        if r.set(f"dialog:{user_id}:admin", admin_id, nx=True, ex=config.DIALOG_TTL):
+            touch_dialog(user_id, admin_id)
+        else:
+            # Lost the race to a concurrent update (or a stale admin); keep the winner.
+            return get_dialog_admin(user_id) or transfer_dialog(user_id, admin_id)[1]
+    except Exception as e:
+        logger.error(f"Redis error in assign_admin: {e}", exc_info=True)
+    return admin_id
+
+def transfer_dialog(user_id: int, admin_id: int):
+    """Move user_id's dialog to admin_id; returns (previous_admin, admin_id)."""
+    try:
+        previous = r.set(f"dialog:{user_id}:admin", admin_id, ex=config.DIALOG_TTL, get=True)
+        previous = int(previous) if previous else None
+        if previous and previous != admin_id:
+            r.zrem(admin_dialogs_key(previous), user_id)
+        touch_dialog(user_id, admin_id)
+        return previous, admin_id
+    except Exception as e:
+        logger.error(f"Redis error in transfer_dialog: {e}", exc_info=True)
+        return None, admin_id
+
+def release_dialog(user_id: int):
+    """Close user_id's dialog (client ended it or restarted the bot)."""
+    try:
+        owner = get_dialog_admin(user_id)
+        if owner is None:
+            return
+        pipe = r.pipeline(transaction=False)
+        pipe.delete(f"dialog:{user_id}:admin")
+        pipe.zrem(admin_dialogs_key(owner), user_id)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Redis error in release_dialog: {e}", exc_info=True)
+
 def format_admin_request(user, user_id, message_text, dt):
     tg_username = f"@{user.username}" if user.username else ""
     name = f"{user.first_name or ''} {user.last_name or ''}".strip()
@@ -280,12 +511,148 @@ def format_admin_request(user, user_id, message_text, dt):
         f"{html.escape(message_text)}"
     )
 
+# -------- CALLBACKS --------
+# callback_data format: "<version>:<action>:<base36 ids...>", e.g. "1:a:2n9c".
+# Kept compact to stay well inside Telegram's 64-byte limit.
+CALLBACK_VERSION = "1"
+CALLBACK_ADMIN_REPLY = "a"
+CALLBACK_USER_REPLY = "u"
+CALLBACK_CLAIM = "c"
+LEGACY_CALLBACK_PREFIXES = {
+    "admin_reply_": CALLBACK_ADMIN_REPLY,
+    "user_reply_": CALLBACK_USER_REPLY,
+}
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def to_base36(value: int) -> str:
+    if value < 0:
+        return "-" + to_base36(-value)
+    digits = ""
+    while True:
+        value, rem = divmod(value, 36)
+        digits = BASE36_DIGITS[rem] + digits
+        if not value:
+            return digits
+
+def encode_callback(action: str, *ids: int) -> str:
+    data = ":".join([CALLBACK_VERSION, action] + [to_base36(int(i)) for i in ids])
+    if len(data.encode("utf-8")) > 64:
+        raise ValueError(f"callback_data too long: {data}")
+    return data
+
+def decode_callback(data: str):
+    """Return (action, ids) or (None, ()) for unknown payloads."""
+    if not data:
+        return None, ()
+    for prefix, action in LEGACY_CALLBACK_PREFIXES.items():
+        if data.startswith(prefix):
+            return action, (int(data[len(prefix):]),)
+    parts = data.split(":")
+    if len(parts) < 2 or parts[0] != CALLBACK_VERSION:
+        return None, ()
+    return parts[1], tuple(int(p, 36) for p in parts[2:])
+
+def answer_callback(call):
+    try:
+        bot.answer_callback_query(call.id)
+    except ApiTelegramException as e:
+        # Expected for redeliveries that reach another process: the query was already answered.
+        logger.warning(f"answer_callback_query rejected: {e}")
+    except Exception as e:
+        logger.error(f"answer_callback_query error: {e}", exc_info=True)
+
+@safe_handler
+def admin_reply_callback(call, user_id):
+    admin_id = call.from_user.id
+    set_admin_reply_target(admin_id, user_id)
+    set_user_state(admin_id, UserStates.REPLY_TO_USER)
+    # Replying takes the dialog over so the client's follow-ups come back here.
+    previous, _ = transfer_dialog(user_id, admin_id)
+    # Отримаємо info юзера (ім'я)
+    info = r.get(f"user:{user_id}:info") or ""
+    if info:
+        who = f"<b>{html.escape(info)}</b> (<code>{user_id}</code>)"
+    else:
+        who = f"<code>{user_id}</code>"
+    if previous and previous != admin_id:
+        safe_send(previous, f"🔁 Діалог з {who} передано іншому адміністратору.", parse_mode="HTML")
+    safe_send(
+        admin_id,
+        f"Ви відповідаєте користувачу {who}. Напишіть текст:",
+        parse_mode="HTML",
+        reply_markup=get_admin_reply_keyboard()
+    )
+
+@safe_handler
+def user_reply_callback(call, admin_id):
+    user_id = call.from_user.id
+    owner = get_dialog_admin(user_id)
+    if owner is None and is_admin(admin_id):
+        # No pin (legacy button or expired dialog): re-pin to the admin who wrote.
+        transfer_dialog(user_id, admin_id)
+    elif owner != admin_id:
+        # Another admin owns this client's dialog (or the payload is forged).
+        safe_send(user_id, Messages.ERROR_DIALOG_CLOSED, parse_mode="HTML", reply_markup=get_main_keyboard())
+        return
+    set_admin_reply_target(admin_id, user_id)
+    set_user_state(user_id, UserStates.REPLY_TO_ADMIN)
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1)
+    markup.add(types.KeyboardButton("❌ Завершити діалог"))
+    safe_send(
+        user_id,
+        "Ви відповідаєте адміністратору. Напишіть текст або натисніть '❌ Завершити діалог' щоб завершити спілкування.",
+        parse_mode="HTML",
+        reply_markup=markup
+    )
+
+@safe_handler
+def claim_dialog_callback(call, user_id):
+    admin_id = call.from_user.id
+    previous, _ = transfer_dialog(user_id, admin_id)
+    info = r.get(f"user:{user_id}:info") or ""
+    who = f"<b>{html.escape(info)}</b> (<code>{user_id}</code>)" if info else f"<code>{user_id}</code>"
+    if previous == admin_id:
+        safe_send(admin_id, f"ℹ️ Діалог з {who} вже закріплений за вами.", parse_mode="HTML")
+        return
+    safe_send(
+        admin_id,
+        f"✅ Ви взяли діалог з {who}. Нові повідомлення клієнта надходитимуть вам.",
+        parse_mode="HTML",
+        reply_markup=get_reply_markup(CALLBACK_ADMIN_REPLY, user_id)
+    )
+    if previous:
+        safe_send(previous, f"🔁 Діалог з {who} передано іншому адміністратору.", parse_mode="HTML")
+
+CALLBACK_ACTIONS = {
+    CALLBACK_ADMIN_REPLY: admin_reply_callback,
+    CALLBACK_USER_REPLY: user_reply_callback,
+    CALLBACK_CLAIM: claim_dialog_callback,
+}
+ADMIN_CALLBACK_ACTIONS = frozenset({CALLBACK_ADMIN_REPLY, CALLBACK_CLAIM})
+
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    # Already acknowledged in process_update.
+    try:
+        action, ids = decode_callback(call.data)
+    except ValueError:
+        action, ids = None, ()
+    handler = CALLBACK_ACTIONS.get(action)
+    if handler is None:
+        logger.warning(f"Unknown callback data: {call.data!r}")
+        return
+    if action in ADMIN_CALLBACK_ACTIONS and not is_admin(call.from_user.id):
+        logger.warning(f"Admin callback {call.data!r} from non-admin {call.from_user.id}")
+        return
+    handler(call, *ids)
+
 # -------- HANDLERИ (user/admin) --------
 
 @bot.message_handler(func=lambda m: m.text == "❌ Завершити діалог")
 @safe_handler
 def handle_end_dialog(message):
     set_user_state(message.from_user.id, UserStates.IDLE)
+    release_dialog(message.from_user.id)
     safe_send(
         message.chat.id,
         "✅ Діалог завершено. Ви повернулись у головне меню.",
@@ -309,6 +676,7 @@ def handle_admin_end_reply(message):
 @safe_handler
 def handle_start(message):
     add_user(message.from_user.id, message.from_user)
+    release_dialog(message.from_user.id)
     if is_admin(message.from_user.id):
         safe_send(
             message.chat.id,
@@ -373,30 +741,10 @@ def handle_user_request(message):
     user_id = user.id
     dt = time.localtime(message.date)
     msg = format_admin_request(user, user_id, message.text, dt)
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("↩️ Відповісти", callback_data=f"admin_reply_{user_id}"))
-    safe_send(config.ADMIN_ID, msg, parse_mode="HTML", reply_markup=markup)
+    markup = get_reply_markup(CALLBACK_ADMIN_REPLY, user_id)
+    safe_send(assign_admin(user_id), msg, parse_mode="HTML", reply_markup=markup)
     safe_send(message.chat.id, Messages.MESSAGE_SENT, parse_mode="HTML", reply_markup=get_record_keyboard())
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("admin_reply_"))
-def admin_reply_callback(call):
-    admin_id = call.from_user.id
-    user_id = int(call.data.replace("admin_reply_", ""))
-    set_admin_reply_target(admin_id, user_id)
-    set_user_state(admin_id, UserStates.REPLY_TO_USER)
-    # Отримаємо info юзера (ім'я)
-    info = r.get(f"user:{user_id}:info") or ""
-    if info:
-        who = f"<b>{html.escape(info)}</b> (<code>{user_id}</code>)"
-    else:
-        who = f"<code>{user_id}</code>"
-    safe_send(
-        admin_id,
-        f"Ви відповідаєте користувачу {who}. Напишіть текст:",
-        parse_mode="HTML",
-        reply_markup=get_admin_reply_keyboard()
-    )
-
 @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and get_user_state(m.from_user.id) == UserStates.REPLY_TO_USER)
 @safe_handler
 def admin_reply_to_user(message):
@@ -405,8 +753,7 @@ def admin_reply_to_user(message):
     admin_id = message.from_user.id
     user_id = get_admin_reply_target(admin_id)
     info = r.get(f"user:{user_id}:info") or f"ID <code>{user_id}</code>"
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("↩️ Відповісти", callback_data=f"user_reply_{admin_id}"))
+    markup = get_reply_markup(CALLBACK_USER_REPLY, admin_id)
     reply_text = (
         f"💬 <b>Відповідь від адміністратора:</b>\n\n"
         f"<b>Кому:</b> {html.escape(info)}\n"
@@ -425,26 +772,12 @@ def admin_reply_to_user(message):
         reply_markup=get_admin_reply_keyboard()
     )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("user_reply_"))
-def user_reply_callback(call):
-    user_id = call.from_user.id
-    admin_id = int(call.data.replace("user_reply_", ""))
-    set_admin_reply_target(admin_id, user_id)
-    set_user_state(user_id, UserStates.REPLY_TO_ADMIN)
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1)
-    markup.add(types.KeyboardButton("❌ Завершити діалог"))
-    safe_send(
-        user_id,
-        "Ви відповідаєте адміністратору. Напишіть текст або натисніть '❌ Завершити діалог' щоб завершити спілкування.",
-        parse_mode="HTML",
-        reply_markup=markup
-    )
-
 @bot.message_handler(func=lambda m: get_user_state(m.from_user.id) == UserStates.REPLY_TO_ADMIN)
 @safe_handler
 def user_reply_to_admin(message):
     if message.text == "❌ Завершити діалог":
         set_user_state(message.from_user.id, UserStates.IDLE)
+        release_dialog(message.from_user.id)
         safe_send(
             message.chat.id,
             "✅ Діалог із адміністратором завершено. Ви повернулись у головне меню.",
@@ -453,9 +786,8 @@ def user_reply_to_admin(message):
         )
         return
     user_id = message.from_user.id
-    admin_id = config.ADMIN_ID
-    markup_inline = types.InlineKeyboardMarkup()
-    markup_inline.add(types.InlineKeyboardButton("↩️ Відповісти", callback_data=f"admin_reply_{user_id}"))
+    admin_id = assign_admin(user_id)
+    markup_inline = get_reply_markup(CALLBACK_ADMIN_REPLY, user_id)
     reply_text = (
         f"↩️ <b>Відповідь клієнта</b>\n"
         f"👤 <b>Клієнт:</b> <a href=\"tg://user?id={user_id}\">{html.escape(message.from_user.first_name or '')}</a>\n"
@@ -475,14 +807,25 @@ def user_reply_to_admin(message):
 @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "📬 Активні діалоги")
 @safe_handler
 def handle_admin_active_dialogs(message):
-    active_users = [uid for uid in get_all_user_ids() if get_user_state(uid) == UserStates.WAITING_FOR_MESSAGE and uid != config.ADMIN_ID]
+    active_users = [uid for uid in get_all_user_ids() if get_user_state(uid) == UserStates.WAITING_FOR_MESSAGE and not is_admin(uid)]
     if active_users:
+        admin_id = message.from_user.id
         markup = types.InlineKeyboardMarkup()
         text = "<b>🔎 Активні діалоги:</b>\n\n"
         for uid in active_users:
             info = r.get(f"user:{uid}:info") or ""
-            text += f"• <code>{uid}</code> {info}\n"
-            markup.add(types.InlineKeyboardButton(f"Відповісти {uid}", callback_data=f"admin_reply_{uid}"))
+            owner = get_dialog_admin(uid)
+            if owner == admin_id:
+                mark = "🙋 ваш"
+            elif owner:
+                mark = f"👤 адмін <code>{owner}</code>"
+            else:
+                mark = "🆓 вільний"
+            text += f"• <code>{uid}</code> {info} — {mark}\n"
+            buttons = [types.InlineKeyboardButton(f"Відповісти {uid}", callback_data=encode_callback(CALLBACK_ADMIN_REPLY, uid))]
+            if owner != admin_id:
+                buttons.append(types.InlineKeyboardButton("🙋 Взяти собі", callback_data=encode_callback(CALLBACK_CLAIM, uid)))
+            markup.row(*buttons)
         safe_send(message.chat.id, text, parse_mode="HTML", reply_markup=markup)
     else:
         safe_send(message.chat.id, "❌ <b>Зараз немає користувачів, які очікують відповіді.</b>", parse_mode="HTML", reply_markup=get_admin_keyboard())
@@ -490,7 +833,7 @@ def handle_admin_active_dialogs(message):
 @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "👥 Користувачі")
 @safe_handler
 def handle_admin_users(message):
-    users = [uid for uid in get_all_user_ids() if uid != config.ADMIN_ID]
+    users = [uid for uid in get_all_user_ids() if not is_admin(uid)]
     if users:
         text = "👥 Список користувачів:\n\n"
         for uid in users:
@@ -506,7 +849,7 @@ def handle_admin_users(message):
 @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "📊 Статистика")
 @safe_handler
 def handle_admin_stats(message):
-    total_users = len([uid for uid in get_all_user_ids() if uid != config.ADMIN_ID])
+    total_users = len([uid for uid in get_all_user_ids() if not is_admin(uid)])
     total_requests = get_stat("user_requests")
     text = f"📊 <b>Статистика:</b>\n\nКористувачів: <b>{total_users}</b>\nЗаявок: <b>{total_requests}</b>"
     safe_send(message.chat.id, text, parse_mode="HTML", reply_markup=get_admin_keyboard())
@@ -514,7 +857,7 @@ def handle_admin_stats(message):
 @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "📢 Розсилка")
 @safe_handler
 def handle_admin_broadcast(message):
-    users = [u for u in get_all_user_ids() if u != config.ADMIN_ID]
+    users = [u for u in get_all_user_ids() if not is_admin(u)]
     text = (
         f"📢 <b>Меню розсилки</b>\n\n"
         f"Користувачів для розсилки: <b>{len(users)}</b>\n"
@@ -527,7 +870,7 @@ def handle_admin_broadcast(message):
 @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and get_admin_state(m.from_user.id) == BROADCAST_STATE)
 @safe_handler
 def handle_admin_broadcast_text(message):
-    users = [uid for uid in get_all_user_ids() if uid != config.ADMIN_ID]
+    users = [uid for uid in get_all_user_ids() if not is_admin(uid)]
     count_delivered = 0
     count_failed = 0
     count_blocked = 0
@@ -607,7 +950,7 @@ def health_check():
         <p><strong>Uptime:</strong> {uptime_hours}год {uptime_minutes}хв</p>
         <p><strong>Час запуску:</strong> {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(bot_start_time))}</p>
         <p><strong>Поточний час:</strong> {time.strftime('%Y-%m-%d %H:%M:%S')}</p>
-        <p><strong>Користувачів:</strong> {len([uid for uid in get_all_user_ids() if uid != config.ADMIN_ID])}</p>
+        <p><strong>Користувачів:</strong> {len([uid for uid in get_all_user_ids() if not is_admin(uid)])}</p>
         """
     except Exception as e:
         logger.error(f"Health page error: {e}", exc_info=True)
@@ -622,7 +965,7 @@ def health():
             "timestamp": time.time(),
             "uptime_seconds": int(time.time() - bot_start_time),
             "bot_username": bot_info.username,
-            "total_users": len([uid for uid in get_all_user_ids() if uid != config.ADMIN_ID]),
+            "total_users": len([uid for uid in get_all_user_ids() if not is_admin(uid)]),
             "version": "3.0-admin-panel-redis"
         }), 200
     except Exception as e:
@@ -640,13 +983,15 @@ def ping():
 @app.route('/status')
 def status():
     try:
-        active_users = [uid for uid in get_all_user_ids() if get_user_state(uid) == UserStates.WAITING_FOR_MESSAGE and uid != config.ADMIN_ID]
+        active_users = [uid for uid in get_all_user_ids() if get_user_state(uid) == UserStates.WAITING_FOR_MESSAGE and not is_admin(uid)]
         return jsonify({
             "bot_status": "running",
             "uptime_seconds": int(time.time() - bot_start_time),
-            "total_users": len([uid for uid in get_all_user_ids() if uid != config.ADMIN_ID]),
+            "total_users": len([uid for uid in get_all_user_ids() if not is_admin(uid)]),
             "active_chats": len(active_users),
+            "duplicate_updates": get_stat("duplicate_updates"),
             "admin_id": config.ADMIN_ID,
+            "admin_backlog": {str(k): v for k, v in get_admin_backlog().items()},
             "timestamp": time.time()
         })
     except Exception as e:
@@ -675,7 +1020,7 @@ def webhook():
         try:
             json_string = request.get_data().decode("utf-8")
             update = telebot.types.Update.de_json(json_string)
-            bot.process_new_updates([update])
+            process_update(update)
             return "", 200
         except Exception as e:
             logger.error(f"Webhook processing error: {e}", exc_info=True)
@@ -691,6 +1036,82 @@ def run_flask():
         threaded=True
     )
 
+# -------- POLLING --------
+POLLING_OFFSET_KEY = "polling:offset"
+
+def get_polling_offset():
+    try:
+        offset = r.get(POLLING_OFFSET_KEY)
+        return int(offset) if offset else None
+    except Exception as e:
+        logger.error(f"Redis error in get_polling_offset: {e}", exc_info=True)
+        return None
+
+def set_polling_offset(offset: int):
+    try:
+        r.set(POLLING_OFFSET_KEY, offset)
+    except Exception as e:
+        logger.error(f"Redis error in set_polling_offset: {e}", exc_info=True)
+
+polling_executor = None
+
+def process_user_updates(updates):
+    failed = 0
+    for update in updates:
+        try:
+            process_update(update)
+        except Exception as e:
+            failed += 1
+            logger.error(f"Polling processing error: {e}", exc_info=True)
+    return failed
+
+def process_polling_batch(updates, offset=None):
+    """Dispatch a getUpdates batch; persist and return (next_offset, failed)."""
+    # The bot is non-threaded in polling mode: handlers run inside the executor
+    # tasks, so once every future is done the whole batch has finished and the
+    # offset is saved. Updates are grouped per sender to keep their order while
+    # different clients are handled in parallel. After a crash the batch is
+    # fetched again; updates that already ran are dropped by the update_id
+    # ledger. An update whose handler raises is logged and skipped, not retried.
+    global polling_executor
+    if polling_executor is None:
+        polling_executor = ThreadPoolExecutor(max_workers=config.POLLING_WORKERS, thread_name_prefix="polling")
+    by_user = {}
+    for update in updates:
+        by_user.setdefault(get_update_user_id(update), []).append(update)
+        offset = update.update_id + 1
+    futures = [polling_executor.submit(process_user_updates, group) for group in by_user.values()]
+    wait(futures)
+    failed = sum(f.result() for f in futures)
+    if offset is not None:
+        set_polling_offset(offset)
+    return offset, failed
+
+def run_polling():
+    offset = get_polling_offset()
+    logger.info(f"Polling started (offset: {offset})")
+    while True:
+        try:
+            updates = bot.get_updates(
+                offset=offset,
+                limit=config.POLLING_BATCH_SIZE,
+                timeout=config.POLLING_TIMEOUT + 10,
+                long_polling_timeout=config.POLLING_TIMEOUT
+            )
+        except Exception as e:
+            logger.error(f"getUpdates error: {e}", exc_info=True)
+            time.sleep(3)
+            continue
+        if not updates:
+            continue
+        started = time.perf_counter()
+        offset, failed = process_polling_batch(updates, offset)
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"Polling batch: {len(updates)} updates in {elapsed:.3f}s "
+            f"({len(updates) / elapsed if elapsed else 0:.1f} upd/s, failed: {failed})"
+        )
+
 def self_ping():
     url = f"{config.WEBHOOK_URL}/keepalive"
     while True:
@@ -706,21 +1127,27 @@ if __name__ == "__main__":
         logger.info("Starting Kuznya Music Studio Bot...")
         bot.remove_webhook()
         time.sleep(1)
-        set_url = f"{config.WEBHOOK_URL}/bot{config.TOKEN}"
-        webhook_result = bot.set_webhook(url=set_url)
-        if webhook_result:
-            logger.info(f"Webhook set: {set_url}")
-        else:
-            logger.warning("Webhook not set!")
         flask_thread = Thread(target=run_flask, daemon=True)
         flask_thread.start()
-        selfping_thread = Thread(target=self_ping, daemon=True)
-        selfping_thread.start()
-        logger.info("🎵 Music Studio Bot started successfully!")
-        logger.info(f"Admin ID: {config.ADMIN_ID}")
-        logger.info("Bot is running via webhook. No polling!")
-        while True:
-            time.sleep(60)
+        if config.RUN_MODE == "polling":
+            logger.info("🎵 Music Studio Bot started successfully!")
+            logger.info(f"Admin IDs: {', '.join(map(str, config.ADMIN_ORDER))} (routing: {config.ADMIN_ROUTING})")
+            logger.info("Bot is running via long polling. No webhook!")
+            run_polling()
+        else:
+            set_url = f"{config.WEBHOOK_URL}/bot{config.TOKEN}"
+            webhook_result = bot.set_webhook(url=set_url)
+            if webhook_result:
+                logger.info(f"Webhook set: {set_url}")
+            else:
+                logger.warning("Webhook not set!")
+            selfping_thread = Thread(target=self_ping, daemon=True)
+            selfping_thread.start()
+            logger.info("🎵 Music Studio Bot started successfully!")
+            logger.info(f"Admin IDs: {', '.join(map(str, config.ADMIN_ORDER))} (routing: {config.ADMIN_ROUTING})")
+            logger.info("Bot is running via webhook. No polling!")
+            while True:
+                time.sleep(60)
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
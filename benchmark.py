@@ -0,0 +1,137 @@
+"""Compare update throughput of the webhook and polling dispatch paths.
+
+Runs the same synthetic batch of "📲 Контакти" messages through both paths
+and reports wall-clock time until every handler has finished. Needs the same
+environment as app.py in webhook mode (BOT_TOKEN, ADMIN_ID, WEBHOOK_URL,
+UPSTASH_REDIS_REST_URL, RUN_MODE unset or 'webhook'); point it at a scratch
+Redis. Telegram sends are replaced with a counter, so no messages leave the
+process.
+
+    python benchmark.py [updates] [webhook_concurrency]
+"""
+import sys
+import json
+import time
+from threading import Condition
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+
+import app
+
+BENCH_USER_BASE = 9_000_000_000
+
+
+class SendCounter:
+    def __init__(self):
+        self.count = 0
+        self._cond = Condition()
+
+    def __call__(self, chat_id, text, **kwargs):
+        with self._cond:
+            self.count += 1
+            self._cond.notify_all()
+
+    def reset(self):
+        with self._cond:
+            self.count = 0
+
+    def wait_for(self, expected, timeout=120):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.count >= expected, timeout=timeout):
+                raise TimeoutError(f"only {self.count}/{expected} handlers finished")
+
+
+def make_updates(first_update_id, count):
+    updates = []
+    for i in range(count):
+        user_id = BENCH_USER_BASE + i
+        updates.append({
+            "update_id": first_update_id + i,
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+                "text": "📲 Контакти",
+            },
+        })
+    return updates
+
+
+def bench_webhook(updates, counter, concurrency):
+    if not hasattr(app.bot, "worker_pool"):
+        raise SystemExit("benchmark.py needs a threaded bot: run it with RUN_MODE unset or 'webhook'")
+    client = app.app.test_client()
+    url = f"/bot{app.config.TOKEN}"
+    payloads = [json.dumps(u) for u in updates]
+
+    def post(payload):
+        return client.post(url, data=payload, content_type="application/json").status_code
+
+    counter.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        statuses = list(pool.map(post, payloads))
+    failed = sum(1 for status in statuses if status != 200)
+    counter.wait_for(len(updates) - failed)
+    elapsed = time.perf_counter() - started
+    return elapsed, failed
+
+
+def bench_polling(updates, counter):
+    # Same setup as RUN_MODE=polling: handlers run inline in the polling workers.
+    app.bot.threaded = False
+    parsed = [telebot.types.Update.de_json(json.dumps(u)) for u in updates]
+    size = app.config.POLLING_BATCH_SIZE
+    saved_offset = app.r.get(app.POLLING_OFFSET_KEY)
+    failed = 0
+    counter.reset()
+    started = time.perf_counter()
+    try:
+        for i in range(0, len(parsed), size):
+            failed += app.process_polling_batch(parsed[i:i + size])[1]
+        counter.wait_for(len(updates) - failed)
+        elapsed = time.perf_counter() - started
+    finally:
+        app.bot.threaded = True
+        if saved_offset is None:
+            app.r.delete(app.POLLING_OFFSET_KEY)
+        else:
+            app.r.set(app.POLLING_OFFSET_KEY, saved_offset)
+    return elapsed, failed
+
+
+def cleanup(updates):
+    keys = [f"update:{u['update_id']}" for u in updates]
+    keys += [f"user:{u['message']['from']['id']}:state" for u in updates]
+    for i in range(0, len(keys), 500):
+        app.r.delete(*keys[i:i + 500])
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    counter = SendCounter()
+    original_send = app.safe_send
+    app.safe_send = counter
+    # Fresh update_ids per run so the dedup ledger does not drop them.
+    base = int(time.time() * 1000) * 10
+    webhook_updates = make_updates(base, count)
+    polling_updates = make_updates(base + count, count)
+    try:
+        results = {
+            f"webhook (concurrency {concurrency})": bench_webhook(webhook_updates, counter, concurrency),
+            f"polling (batch {app.config.POLLING_BATCH_SIZE})": bench_polling(polling_updates, counter),
+        }
+    finally:
+        app.safe_send = original_send
+        cleanup(webhook_updates + polling_updates)
+
+    print(f"{count} updates per mode, wall clock until all handlers finished")
+    for mode, (elapsed, failed) in results.items():
+        print(f"  {mode:<28} {elapsed:8.3f}s  {count / elapsed:9.1f} upd/s  failed: {failed}")
+
+
+if __name__ == "__main__":
+    main()